@@ -0,0 +1,356 @@
+import argparse
+from pathlib import Path
+
+import httplib2
+import orjson
+import pytest
+from googleapiclient.errors import HttpError
+
+from youtube_playlists.main import (
+    QUOTA_EXCEEDED_MESSAGE,
+    Playlist,
+    PlaylistVideo,
+    QuotaExceededError,
+    VideoStatus,
+    YoutubePlaylistSplitter,
+    main,
+    split_evenly,
+    time_to_words,
+    view_stats,
+)
+
+
+@pytest.fixture
+def splitter(tmp_path):
+    splitter = YoutubePlaylistSplitter(checkpoint_filename=str(tmp_path / 'progress.json'))
+    splitter.load()
+    return splitter
+
+
+def make_playlist(title, size):
+    videos = [PlaylistVideo(id=f'{title}-{i}') for i in range(size)]
+    return Playlist(id=None, title=title, description='', videos=videos)
+
+
+def http_error(status, message=''):
+    content = orjson.dumps({'error': {'message': message}}) if message else b''
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+class StubRequest:
+    def __init__(self, outcome, method_id='youtube.playlistItems.insert'):
+        self.outcome = outcome
+        self.methodId = method_id
+
+
+class StubBatch:
+    def __init__(self, callback, error):
+        self.callback = callback
+        self.error = error
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        if self.error is not None:
+            raise self.error
+        for request_id, request in reversed(self.requests):  # responses can arrive in any order
+            if isinstance(request.outcome, HttpError):
+                self.callback(request_id, None, request.outcome)
+            else:
+                self.callback(request_id, request.outcome, None)
+
+
+class StubYoutube:
+    def __init__(self, batch_errors=()):
+        self.batch_errors = list(batch_errors)
+
+    def new_batch_http_request(self, callback):
+        return StubBatch(callback, self.batch_errors.pop(0) if self.batch_errors else None)
+
+
+class StubListRequest:
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.headers = {}
+
+    def execute(self):
+        if isinstance(self.outcome, HttpError):
+            raise self.outcome
+        return self.outcome
+
+
+class StubPlaylistItems:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def list(self, **kwargs):
+        self.requests.append(StubListRequest(self.outcomes.pop(0)))
+        return self.requests[-1]
+
+
+class StubPlaylistItemsYoutube:
+    def __init__(self, outcomes):
+        self.playlist_items = StubPlaylistItems(outcomes)
+
+    def playlistItems(self):
+        return self.playlist_items
+
+
+def playlist_items_page(etag, *video_ids):
+    items = [
+        {'id': f'item-{video_id}', 'snippet': {'title': video_id, 'resourceId': {'videoId': video_id}}}
+        for video_id in video_ids
+    ]
+    return {'etag': etag, 'items': items}
+
+
+@pytest.fixture
+def batch_splitter(splitter, monkeypatch):
+    monkeypatch.setattr(splitter, 'RETRY_DELAY', 0)
+    splitter.youtube = StubYoutube()
+    splitter.successes = []
+    splitter.errors = []
+    return splitter
+
+
+def execute_batch(splitter, requests):
+    splitter.execute_batch(
+        requests,
+        on_success=lambda item, response: splitter.successes.append((item, response)),
+        on_error=lambda item, error: splitter.errors.append((item, error.resp.status)),
+    )
+
+
+@pytest.mark.parametrize(
+    'length, target_size, expected_sizes',
+    [
+        (180, 90, [90, 90]),
+        (230, 90, [77, 77, 76]),
+        (225, 90, [75, 75, 75]),
+        (10, 90, [10]),
+        (100, 30, [34, 33, 33]),
+    ],
+)
+def test_split_evenly_sizes(length, target_size, expected_sizes):
+    lists = list(split_evenly(list(range(length)), target_size))
+    assert [len(lst) for lst in lists] == expected_sizes
+    assert [item for lst in lists for item in lst] == list(range(length))
+
+
+def test_split_evenly_empty():
+    assert list(split_evenly([], 90)) == []
+
+
+def test_main_exits_when_source_playlist_is_empty(tmp_path, monkeypatch):
+    monkeypatch.setattr(YoutubePlaylistSplitter, 'authenticate', lambda self, secret_file, token_file: None)
+    monkeypatch.setattr(YoutubePlaylistSplitter, 'get_playlist_id_from_name', lambda self, name: 'PL1')
+    monkeypatch.setattr(YoutubePlaylistSplitter, 'get_videos_from_playlist_id', lambda self, playlist_id: [])
+    args = argparse.Namespace(
+        view_logs=False,
+        view_stats=False,
+        view_video_errors=False,
+        checkpoint_file=str(tmp_path / 'progress.json'),
+        secret_file='client_secret.json',
+        token_file='token.json',
+        playlist='WSC',
+        new_playlist='WSC',
+        target_size=90,
+        delete_original=False,
+        refresh_metadata=False,
+        exit_on_quota=False,
+    )
+    with pytest.raises(SystemExit) as exit_info:
+        main(args)
+    assert exit_info.value.code == 0
+
+
+def test_execute_batch_maps_responses_to_items(batch_splitter):
+    requests = [('a', StubRequest('first')), ('a', StubRequest('second')), ('b', StubRequest(http_error(404)))]
+    execute_batch(batch_splitter, requests)
+    assert sorted(batch_splitter.successes) == [('a', 'first'), ('a', 'second')]
+    assert batch_splitter.errors == [('b', 404)]
+
+
+def test_execute_batch_raises_on_quota_exceeded_without_failing_item(batch_splitter):
+    requests = [('a', StubRequest(http_error(403, QUOTA_EXCEEDED_MESSAGE))), ('b', StubRequest('ok'))]
+    with pytest.raises(QuotaExceededError):
+        execute_batch(batch_splitter, requests)
+    assert batch_splitter.successes == [('b', 'ok')]
+    assert batch_splitter.errors == []
+
+
+@pytest.mark.parametrize('status', [409, 503])
+def test_execute_batch_retries_transient_errors_then_fails_item(batch_splitter, status):
+    requests = [('a', StubRequest(http_error(status)))]
+    for _ in range(batch_splitter.MAX_ATTEMPTS - 1):
+        execute_batch(batch_splitter, requests)
+        assert batch_splitter.errors == []
+    execute_batch(batch_splitter, requests)
+    assert batch_splitter.errors == [('a', status)]
+
+
+def test_execute_batch_transient_attempts_reset_on_success(batch_splitter):
+    execute_batch(batch_splitter, [('a', StubRequest(http_error(503)))] * (batch_splitter.MAX_ATTEMPTS - 1))
+    execute_batch(batch_splitter, [('a', StubRequest('ok'))])
+    execute_batch(batch_splitter, [('a', StubRequest(http_error(503)))])
+    assert batch_splitter.errors == []
+
+
+def test_execute_batch_whole_batch_server_error_is_transient(batch_splitter):
+    batch_splitter.youtube = StubYoutube(batch_errors=[http_error(503)] * batch_splitter.MAX_ATTEMPTS)
+    requests = [('a', StubRequest('ok')), ('b', StubRequest('ok'))]
+    for _ in range(batch_splitter.MAX_ATTEMPTS - 1):
+        execute_batch(batch_splitter, requests)
+        assert batch_splitter.errors == []
+    execute_batch(batch_splitter, requests)
+    assert batch_splitter.errors == [('a', 503), ('b', 503)]
+    execute_batch(batch_splitter, requests)
+    assert batch_splitter.successes == [('b', 'ok'), ('a', 'ok')]
+
+
+def test_execute_batch_whole_batch_client_error_is_raised(batch_splitter):
+    batch_splitter.youtube = StubYoutube(batch_errors=[http_error(400)])
+    with pytest.raises(HttpError):
+        execute_batch(batch_splitter, [('a', StubRequest('ok'))])
+
+
+def test_get_videos_from_playlist_id_caches_page(splitter):
+    splitter.youtube = StubPlaylistItemsYoutube([playlist_items_page('etag-1', 'v1', 'v2')])
+    videos = splitter.get_videos_from_playlist_id('PL1')
+    assert [video.id for video in videos] == ['v1', 'v2']
+    assert splitter.youtube.playlist_items.requests[0].headers == {}
+    splitter.save()
+
+    reloaded = YoutubePlaylistSplitter(checkpoint_filename=splitter.checkpoint_filename)
+    reloaded.load()
+    assert reloaded.page_cache['PL1:'].etag == 'etag-1'
+    assert 'page_cache' not in orjson.loads(Path(splitter.checkpoint_filename).read_bytes())
+
+
+def test_get_videos_from_playlist_id_reuses_page_when_not_modified(splitter):
+    splitter.youtube = StubPlaylistItemsYoutube([playlist_items_page('etag-1', 'v1', 'v2'), http_error(304)])
+    splitter.get_videos_from_playlist_id('PL1')
+    videos = splitter.get_videos_from_playlist_id('PL1')
+    assert [video.id for video in videos] == ['v1', 'v2']
+    assert splitter.youtube.playlist_items.requests[1].headers == {'If-None-Match': 'etag-1'}
+
+
+def test_get_videos_from_playlist_id_not_modified_without_cached_page_is_raised(splitter):
+    splitter.youtube = StubPlaylistItemsYoutube([http_error(304)])
+    with pytest.raises(HttpError):
+        splitter.get_videos_from_playlist_id('PL1')
+
+
+def test_write_ahead_log_is_replayed_on_load(splitter):
+    splitter.data.playlists = [make_playlist('a', 2)]
+    splitter.save()
+    video = splitter.data.playlists[0].videos[1]
+    video.status = VideoStatus.SUCCESS
+    video.id_with_playlist = 'item-1'
+    splitter.write_ahead(0, 1)
+    splitter.data.playlists[0].id = 'PL1'
+    splitter.write_ahead(0)
+    splitter.sync_wal()
+
+    reloaded = YoutubePlaylistSplitter(checkpoint_filename=splitter.checkpoint_filename)
+    reloaded.load()
+    playlist = reloaded.data.playlists[0]
+    assert playlist.id == 'PL1'
+    assert [video.status for video in playlist.videos] == [VideoStatus.PENDING, VideoStatus.SUCCESS]
+    assert playlist.videos[1].id_with_playlist == 'item-1'
+    assert reloaded._pending_count == 1
+
+
+def test_write_ahead_log_torn_record_is_truncated(splitter):
+    splitter.data.playlists = [make_playlist('a', 2)]
+    splitter.save()
+    splitter.data.playlists[0].videos[0].status = VideoStatus.SUCCESS
+    splitter.write_ahead(0, 0)
+    splitter.sync_wal()
+    with open(splitter.wal_filename, 'ab') as wal:
+        wal.write(b'{"ts":1,"playl')
+
+    reloaded = YoutubePlaylistSplitter(checkpoint_filename=splitter.checkpoint_filename)
+    reloaded.load()
+    reloaded.data.playlists[0].videos[1].status = VideoStatus.ERROR
+    reloaded.write_ahead(0, 1)
+    reloaded.sync_wal()
+
+    reloaded_again = YoutubePlaylistSplitter(checkpoint_filename=splitter.checkpoint_filename)
+    reloaded_again.load()
+    statuses = [video.status for video in reloaded_again.data.playlists[0].videos]
+    assert statuses == [VideoStatus.SUCCESS, VideoStatus.ERROR]
+
+
+def test_write_ahead_log_replay_stops_at_record_for_other_video(splitter):
+    splitter.data.playlists = [make_playlist('a', 2)]
+    splitter.save()
+    splitter.data.playlists[0].videos[0].status = VideoStatus.SUCCESS
+    splitter.write_ahead(0, 0)
+    splitter.data.playlists[0].videos[1].status = VideoStatus.SUCCESS
+    splitter.write_ahead(0, 1)
+    splitter.sync_wal()
+    splitter.data.playlists = [make_playlist('a', 1)]
+    splitter.data.playlists[0].videos.append(PlaylistVideo(id='other'))
+    splitter._write_atomic(splitter.checkpoint_filename, orjson.dumps(splitter.data))
+
+    reloaded = YoutubePlaylistSplitter(checkpoint_filename=splitter.checkpoint_filename)
+    reloaded.load()
+    statuses = [video.status for playlist in reloaded.data.playlists for video in playlist.videos]
+    assert statuses == [VideoStatus.SUCCESS, VideoStatus.PENDING]
+    assert reloaded._wal_records == 1
+
+
+def test_save_removes_write_ahead_log(splitter, tmp_path):
+    splitter.data.playlists = [make_playlist('a', 1)]
+    splitter.write_ahead(0, 0)
+    splitter.sync_wal()
+    assert (tmp_path / 'progress.json.wal').exists()
+    splitter.save()
+    assert not (tmp_path / 'progress.json.wal').exists()
+
+
+def test_load_existing_checkpoint_does_not_create_write_ahead_log(splitter, tmp_path):
+    YoutubePlaylistSplitter(checkpoint_filename=splitter.checkpoint_filename).load()
+    assert not (tmp_path / 'progress.json.wal').exists()
+
+
+def test_add_new_playlist_videos_fills_shortest_first_playlist_on_tie(splitter):
+    splitter.data.playlists = [make_playlist(title, size) for title, size in [('a', 3), ('b', 1), ('c', 2), ('d', 1)]]
+    splitter.add_new_playlist_videos([PlaylistVideo(id=f'new-{i}') for i in range(6)])
+    new_ids = [
+        [video.id for video in playlist.videos if video.id.startswith('new')] for playlist in splitter.data.playlists
+    ]
+    assert new_ids == [['new-5'], ['new-0', 'new-2'], ['new-3'], ['new-1', 'new-4']]
+    assert splitter.has_pending_videos_to_process()
+
+
+def test_add_new_playlist_videos_without_playlists(splitter):
+    splitter.add_new_playlist_videos([PlaylistVideo(id='new-0')])
+    assert splitter.data.playlists == []
+    assert not splitter.has_pending_videos_to_process()
+
+
+@pytest.mark.parametrize(
+    'seconds, expected',
+    [
+        (0, '0 hours, 0 minutes, 0 seconds'),
+        (59.4, '0 hours, 0 minutes, 59 seconds'),
+        (59.5, '0 hours, 1 minutes, 0 seconds'),
+        (3599.6, '1 hours, 0 minutes, 0 seconds'),
+        (3661, '1 hours, 1 minutes, 1 seconds'),
+    ],
+)
+def test_time_to_words(seconds, expected):
+    assert time_to_words(seconds) == expected
+
+
+def test_view_stats(splitter, capsys):
+    splitter.data.playlists = [make_playlist('a', 3), make_playlist('b', 0), make_playlist('c', 2)]
+    splitter.save()
+    capsys.readouterr()
+    view_stats(splitter.checkpoint_filename)
+    assert capsys.readouterr().out.splitlines() == ['a'.ljust(20) + ' 3', 'b'.ljust(20) + ' 0', 'c'.ljust(20) + ' 2']
@@ -1,26 +1,59 @@
 import argparse
-import json
+import heapq
 import os
 import random
 import sys
 import time
 from contextlib import contextmanager
-from dataclasses import asdict, dataclass, field
-from datetime import datetime
+from dataclasses import dataclass, field
 from enum import StrEnum
-from functools import lru_cache
 from pathlib import Path
 
+import ijson
+import orjson
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 
-def youtube_authenticate_oauth(filename):
-    flow = InstalledAppFlow.from_client_secrets_file(
-        Path.cwd() / filename, scopes=['https://www.googleapis.com/auth/youtube']
-    )
-    return build('youtube', 'v3', credentials=flow.run_local_server())
+QUOTA_EXCEEDED_MESSAGE = 'The request cannot be completed because you have exceeded'
+SCOPES = ['https://www.googleapis.com/auth/youtube']
+EX_TEMPFAIL = 75  # exit code for "try again later", see sysexits.h
+
+
+def save_credentials(token_path, credentials):
+    """Write OAuth credentials to `token_path`, readable only by the owner as it contains secrets."""
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(token_path, 0o600)  # the mode above only applies to new files
+    with os.fdopen(fd, 'w') as f:
+        f.write(credentials.to_json())
+
+
+def youtube_authenticate_oauth(filename, token_filename):
+    """Build the YouTube API client with OAuth credentials.
+
+    Credentials are cached in `token_filename` and refreshed when expired,
+    so the browser consent flow only runs when there is no usable token,
+    including when the refresh token has been revoked or has expired.
+    """
+    token_path = Path.cwd() / token_filename
+    credentials = None
+    if token_path.exists():
+        credentials = Credentials.from_authorized_user_file(token_path, SCOPES)
+        if credentials.expired and credentials.refresh_token:
+            try:
+                credentials.refresh(Request())
+                save_credentials(token_path, credentials)
+            except RefreshError:
+                credentials = None
+    if not (credentials and credentials.valid):
+        flow = InstalledAppFlow.from_client_secrets_file(Path.cwd() / filename, scopes=SCOPES)
+        credentials = flow.run_local_server()
+        save_credentials(token_path, credentials)
+    return build('youtube', 'v3', credentials=credentials)
 
 
 def get_user_confirmation(message):
@@ -46,61 +79,72 @@ def chunks(lst, n):
 def split_evenly(lst, target_size):
     """Split close to the target_size.
 
-    If number remaining is greater than half the target_size,
-    add an extra list and distribute the remaining elements.
+    Use the number of lists that gives a size closest to the target_size (the fewer lists on a tie),
+    and distribute the remaining elements one each to the first lists.
 
     Args:
         lst: List to split
         target_size: Target size of each list
 
-    Returns:
-        list[list[Any]]: List of lists split as evenly as possible
+    Yields:
+        list[Any]: Lists split as evenly as possible
     """
     length = len(lst)
-    num_lists, remain = divmod(length, target_size)
-    if remain > length // 2:
-        num_lists += 1
+    if not length:
+        return
+    fewer_lists = max(1, length // target_size)
+    num_lists = min(fewer_lists, fewer_lists + 1, key=lambda n: abs(length / n - target_size))
     split_size, remain = divmod(length, num_lists)
-    new_lists = []
-    start = 0
     for i in range(num_lists):
-        end = start + split_size
-        if i < remain:
-            end += 1  # add extra element until all remaining are gone
-        new_lists.append(lst[start:end])
-        start = end
-    return new_lists
+        # the first `remain` lists get one extra element
+        yield lst[i * split_size + min(i, remain) : (i + 1) * split_size + min(i + 1, remain)]
+
+
+def http_error_message(error: HttpError) -> str:
+    """Extract the API error message from the body of an `HttpError`.
+
+    Some responses (e.g. 304 Not Modified) have no body, return an empty message for those.
+    """
+    try:
+        return orjson.loads(error.content).get('error', {}).get('message', '')
+    except ValueError:
+        return ''
+
+
+def is_transient_error(error: HttpError) -> bool:
+    """Conflict (409) and server (5xx) errors are worth retrying, other errors will fail the same way again."""
+    return error.resp.status == 409 or error.resp.status >= 500
 
 
 def time_to_words(seconds):
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    seconds = round(seconds % 60)
-    if seconds >= 60:
-        seconds = 0.0
-        minutes += 1
-    if minutes >= 60:
-        minutes = 0.0
-        hours += 1
+    hours, remaining = divmod(round(seconds), 3600)
+    minutes, seconds = divmod(remaining, 60)
     return f'{hours} hours, {minutes} minutes, {seconds} seconds'
 
 
 def view_logs(filename):
+    """Print the progress logs, streaming them from the file instead of loading the whole checkpoint."""
     if Path(filename).exists():
-        with open(filename) as f:
-            data = json.load(f)
-            for log in data['progress_logs']:
+        with open(filename, 'rb') as f:
+            for log in ijson.items(f, 'progress_logs.item'):
                 print(log)
     else:
         print(f'File {filename} does not exist.')
 
 
 def view_stats(filename):
+    """Print the number of videos in each playlist, counting them while streaming the file."""
     if Path(filename).exists():
-        with open(filename) as f:
-            data = json.load(f)
-            for playlist in data['playlists']:
-                print(playlist['title'].ljust(20), len(playlist['videos']))
+        with open(filename, 'rb') as f:
+            title, video_count = '', 0
+            for prefix, event, value in ijson.parse(f):
+                if prefix == 'playlists.item.title':
+                    title = value
+                elif prefix == 'playlists.item.videos.item' and event == 'start_map':
+                    video_count += 1
+                elif prefix == 'playlists.item' and event == 'end_map':
+                    print(title.ljust(20), video_count)
+                    title, video_count = '', 0
     else:
         print(f'File {filename} does not exist.')
 
@@ -144,6 +188,16 @@ class Playlist:
     videos: list[PlaylistVideo]
 
 
+@dataclass
+class CachedPage:
+    """A page of playlist items with the ETag it was returned with, to revalidate with `If-None-Match`."""
+
+    playlist_id: str
+    etag: str
+    items: list[dict]
+    next_page_token: str | None = None
+
+
 @dataclass
 class PlaylistSplitterData:
     last_run_time: float = 0
@@ -154,41 +208,170 @@ class PlaylistSplitterData:
 
 class YoutubePlaylistSplitter:
     ONE_DAY = 60 * 60 * 24
-    FOUR_HOURS = 60 * 60 * 4
+    MAX_PROGRESS_LOGS = 10_000  # older log messages are dropped when saving
+    LOG_LEVEL_INFO = '[INFO] '
+    LOG_LEVEL_ERROR = '[ERROR]'
+    BATCH_SIZE = 50  # maximum number of calls the API accepts in a single batch request
+    RETRY_DELAY = 10  # seconds to wait after a batch with transient errors
+    MAX_ATTEMPTS = 3  # transient errors before a request is treated as failed
+    COMPACT_EVERY = 500  # write-ahead log records before the log is folded into a new checkpoint
+    WAL_VIDEO_FIELDS = (
+        'status',
+        'id_with_playlist',
+        'previous_id_with_playlist',
+        'playlist_id',
+        'previous_playlist_id',
+        'error_message',
+    )
 
     def __init__(self, checkpoint_filename: str):
         self.checkpoint_filename = checkpoint_filename
+        self.wal_filename = f'{checkpoint_filename}.wal'
+        self.page_cache_filename = f'{checkpoint_filename}.pages.json'
+        self.page_cache: dict[str, CachedPage] = {}
+        self._page_cache_dirty = False
+        self._wal = None
+        self._wal_records = 0
+        self._videos_dirty = True
+        self._all_videos: list[PlaylistVideo] = []
+        self._all_videos_index: dict[str, PlaylistVideo] | None = None
+        self._pending_count = 0
+        self._playlist_id_cache: dict[str, str] = {}
+        self._transient_attempts: dict[tuple, int] = {}
 
     def load(self) -> None:
         """
         Load progress data from file into `self.data`.
 
         If the file does not exist, create empty `self.data` and save it.
+        Changes recorded in the write-ahead log since the last save are replayed on top of the file.
+        Cached playlist pages are loaded from their own file into `self.page_cache`.
         """
-
+        self._wal_records = 0
+        self._videos_dirty = True
+        self.page_cache = {}
+        self._page_cache_dirty = False
+        if Path(self.page_cache_filename).exists():
+            with open(self.page_cache_filename, 'rb') as f:
+                self.page_cache = {key: CachedPage(**page) for key, page in orjson.loads(f.read()).items()}
         if not Path(self.checkpoint_filename).exists():
             self.data = PlaylistSplitterData()
             self.log_info('Created new progress data file.')
             self.save()
             return
-        with open(self.checkpoint_filename) as f:
-            data = json.load(f)
+        with open(self.checkpoint_filename, 'rb') as f:
+            data = orjson.loads(f.read())
             data['playlists'] = [Playlist(**playlist) for playlist in data['playlists']]
             for playlist in data['playlists']:
                 playlist.videos = [PlaylistVideo(**video) for video in playlist.videos]
+            data.pop('page_cache', None)  # pages used to be cached in the checkpoint
             self.data = PlaylistSplitterData(**data)
-            self.log_info('Loaded progress data file.')
+        self._replay_wal()
+        self._pending_count = sum(video.status == VideoStatus.PENDING for video in self.all_videos)
+        self.log_info('Loaded progress data file.')
 
     def save(self) -> None:
         """
-        Save `self.data` to `self.checkpoint_filename` as json.
+        Save `self.data` to `self.checkpoint_filename` as json and empty the write-ahead log.
 
-        Mark the timestamp before saving.
+        Mark the timestamp before saving, and keep only the last `self.MAX_PROGRESS_LOGS` log messages.
+        The page cache is saved to `self.page_cache_filename` if it changed since the last save.
         """
         self._mark_timestamp()
         self.log_info('Saving...')
-        with open(self.checkpoint_filename, 'w') as f:
-            json.dump(asdict(self.data), f, indent=4)
+        del self.data.progress_logs[: -self.MAX_PROGRESS_LOGS]
+        if self._page_cache_dirty:
+            self._write_atomic(self.page_cache_filename, orjson.dumps(self.page_cache))
+            self._page_cache_dirty = False
+        self._write_atomic(self.checkpoint_filename, orjson.dumps(self.data, option=orjson.OPT_INDENT_2))
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        Path(self.wal_filename).unlink(missing_ok=True)
+        self._wal_records = 0
+
+    @staticmethod
+    def _write_atomic(filename: str, content: bytes) -> None:
+        """Write to a temporary file first and swap it in, so a crash never leaves a partial file."""
+        temp_filename = f'{filename}.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())  # the data must be on disk before the rename is, or a crash can leave an empty file
+        os.replace(temp_filename, filename)
+
+    def write_ahead(self, playlist_index: int, video_index: int | None = None) -> None:
+        """
+        Append the current state of a playlist or video to the write-ahead log.
+
+        Appending a line is O(1), unlike :meth:`self.save` which rewrites the whole checkpoint.
+        Records are addressed by position, as the same video can be in a playlist more than once.
+        Call :meth:`self.sync_wal` to make the records durable.
+        The log file is only created when the first record is written, so reading a checkpoint never creates it.
+        """
+        if self._wal is None:
+            self._wal = open(self.wal_filename, 'ab')
+        playlist = self.data.playlists[playlist_index]
+        record = {'ts': time.time(), 'playlist': playlist_index}
+        if video_index is None:
+            record['id'] = playlist.id
+        else:
+            video = playlist.videos[video_index]
+            record |= {'video': video_index, 'video_id': video.id}
+            record |= {name: getattr(video, name) for name in self.WAL_VIDEO_FIELDS}
+        self._wal.write(orjson.dumps(record) + b'\n')
+        self._wal_records += 1
+
+    def sync_wal(self) -> None:
+        """Flush the write-ahead log to disk.
+
+        Unlike :meth:`self.save`, this does not mark a new timestamp, so it is safe while waiting for the quota reset.
+        """
+        if self._wal is not None:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+
+    def _replay_wal(self) -> None:
+        """Apply the records of the write-ahead log to `self.data`, in the order they were written.
+
+        A partially written last record (from a crash while writing) is cut off the file,
+        so new records are not appended to the broken line and lost on the next replay.
+        A record for a position that does not hold the same video, e.g. if the checkpoint was replaced,
+        stops the replay the same way, instead of changing the wrong videos.
+        """
+        if not Path(self.wal_filename).exists():
+            return
+        with open(self.wal_filename, 'r+b') as wal:
+            offset = 0
+            for line in wal:
+                try:
+                    record = orjson.loads(line) if line.endswith(b'\n') else None
+                except ValueError:
+                    record = None
+                if record is not None and not self._wal_record_matches(record):
+                    self.log_error(f'Write-ahead log does not match {self.checkpoint_filename}, stopping replay.')
+                    record = None
+                if record is None:
+                    wal.truncate(offset)
+                    break
+                offset += len(line)
+                playlist = self.data.playlists[record['playlist']]
+                if 'video' in record:
+                    video = playlist.videos[record['video']]
+                    for name in self.WAL_VIDEO_FIELDS:
+                        setattr(video, name, record[name])
+                else:
+                    playlist.id = record['id']
+                self._wal_records += 1
+
+    def _wal_record_matches(self, record: dict) -> bool:
+        """Check that the position of a write-ahead log record exists and holds the video it was written for."""
+        if not 0 <= record['playlist'] < len(self.data.playlists):
+            return False
+        if 'video' not in record:
+            return True
+        videos = self.data.playlists[record['playlist']].videos
+        return 0 <= record['video'] < len(videos) and videos[record['video']].id == record['video_id']
 
     def _mark_timestamp(self):
         """
@@ -196,7 +379,7 @@ class YoutubePlaylistSplitter:
         """
         self.data.last_run_time = time.time()
 
-    def _log(self, message: str):
+    def _log(self, level: str, message: str):
         """
         Create log message and append it to `self.data.progress_logs`.
 
@@ -204,33 +387,57 @@ class YoutubePlaylistSplitter:
         Do Not save in this method, as some log messages are
         console only (e.g. errors) and should not be saved.
         """
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        level, message = message.split(' | ', 1)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
         output = f'{level} {timestamp} | {message}'
         self.data.progress_logs.append(output)
         return output
 
     def log_error(self, message):
-        output = f'[ERROR] | {message}'
-        print(self._log(output))
+        print(self._log(self.LOG_LEVEL_ERROR, message))
 
     def log_info(self, message):
-        output = f'[INFO]  | {message}'
-        print(self._log(output))
+        print(self._log(self.LOG_LEVEL_INFO, message))
 
-    def authenticate(self, filename):
+    def authenticate(self, filename, token_filename):
         """
         Authenticate with YouTube API using OAuth2 credentials.
         """
         try:
-            self.youtube = youtube_authenticate_oauth(filename)
+            self.youtube = youtube_authenticate_oauth(filename, token_filename)
         except Exception as e:
             self.log_error(f'Error authenticating with OAuth: {e}')
             sys.exit(1)
 
+    def invalidate_page_cache(self, playlist_ids: set[str]):
+        """Remove cached pages of playlists after they have been changed."""
+        for key in [key for key, page in self.page_cache.items() if page.playlist_id in playlist_ids]:
+            del self.page_cache[key]
+            self._page_cache_dirty = True
+
+    def clear_page_cache(self):
+        """Remove all cached pages, so every page is fetched again."""
+        self.page_cache.clear()
+        self._page_cache_dirty = True
+
     @property
-    def all_videos(self):
-        return [video for playlist in self.data.playlists for video in playlist.videos]
+    def all_videos(self) -> list[PlaylistVideo]:
+        """Videos in all playlists.
+
+        Cached, and only rebuilt after videos are added to `self.data.playlists` (`self._videos_dirty` is set).
+        """
+        if self._videos_dirty:
+            self._all_videos = [video for playlist in self.data.playlists for video in playlist.videos]
+            self._all_videos_index = None
+            self._videos_dirty = False
+        return self._all_videos
+
+    @property
+    def all_videos_index(self) -> dict[str, PlaylistVideo]:
+        """Videos in all playlists by video ID, built on first access after :attr:`self.all_videos` is rebuilt."""
+        all_videos = self.all_videos
+        if self._all_videos_index is None:
+            self._all_videos_index = {video.id: video for video in all_videos}
+        return self._all_videos_index
 
     @contextmanager
     def handle_quota_exceeded(self):
@@ -261,31 +468,104 @@ class YoutubePlaylistSplitter:
         try:
             yield
         except HttpError as e:
-            error_message = json.loads(e.content.decode()).get('error', {}).get('message', '')
-            if 'The request cannot be completed because you have exceeded' in error_message:
+            error_message = http_error_message(e)
+            if QUOTA_EXCEEDED_MESSAGE in error_message:
                 self.log_error(error_message)
                 raise QuotaExceededError from e
             else:
                 raise e
 
-    def check_for_quota_violation(self):
-        """Check for API quota violation and wait 24 hours if exceeded.
+    def execute_batch(self, requests, on_success, on_error, changed_playlist_ids=None):
+        """Execute API requests in batches of `self.BATCH_SIZE` HTTP round-trips.
+
+        Each request is a tuple of ``(item, request)``. The callbacks are called with the item
+        and either the response or the `HttpError` for that single request.
+        Callbacks record their changes with :meth:`self.write_ahead`, the log is synced once per batch
+        and a new checkpoint is saved every `self.COMPACT_EVERY` records.
+        Callbacks add the IDs of playlists they changed to `changed_playlist_ids`,
+        their cached pages are invalidated once per batch.
+
+        Quota exceeded errors on individual requests do not call `on_error`, the item is left untouched
+        so it is retried on the next run. After the batch is synced, `QuotaExceededError` is raised.
+
+        Conflict (409) and server (5xx) errors are transient, e.g. from concurrent inserts into the same playlist
+        within a batch, as is a 5xx for the whole batch request. They do not call `on_error` either,
+        the item is left untouched to be retried and the next batch waits `self.RETRY_DELAY` seconds.
+        After `self.MAX_ATTEMPTS` transient errors for the same item, `on_error` is called with the last error.
+
+        Raises:
+            QuotaExceededError: If the quota is exceeded during any request in the batch.
+        """
+        for batch_requests in chunks(requests, self.BATCH_SIZE):
+            quota_errors = []
+            transient_errors = []
+
+            def callback(request_id, response, exception, batch_requests=batch_requests):
+                item, request = batch_requests[int(request_id)]
+                if exception is None:
+                    self._transient_attempts.pop((request.methodId, item), None)
+                    on_success(item, response)
+                elif QUOTA_EXCEEDED_MESSAGE in http_error_message(exception):
+                    quota_errors.append(http_error_message(exception))
+                elif is_transient_error(exception):
+                    transient_errors.append((item, request, exception))
+                else:
+                    self._transient_attempts.pop((request.methodId, item), None)
+                    on_error(item, exception)
+
+            batch = self.youtube.new_batch_http_request(callback=callback)
+            for i, (_, request) in enumerate(batch_requests):
+                batch.add(request, request_id=str(i))  # items can repeat, so index instead of video id
+            try:
+                with self.handle_quota_exceeded():
+                    batch.execute()
+            except HttpError as e:
+                if not is_transient_error(e):
+                    raise
+                transient_errors.extend((item, request, e) for item, request in batch_requests)
+            retrying = 0
+            for item, request, error in transient_errors:
+                key = (request.methodId, item)  # positions repeat across request types, e.g. insert and delete
+                self._transient_attempts[key] = self._transient_attempts.get(key, 0) + 1
+                if self._transient_attempts[key] >= self.MAX_ATTEMPTS:
+                    del self._transient_attempts[key]
+                    on_error(item, error)
+                else:
+                    retrying += 1
+            if changed_playlist_ids:
+                self.invalidate_page_cache(changed_playlist_ids)
+                changed_playlist_ids.clear()
+            self.sync_wal()
+            if self._wal_records >= self.COMPACT_EVERY:
+                self.save()
+            if quota_errors:
+                self.log_error(quota_errors[0])
+                raise QuotaExceededError
+            if transient_errors:
+                self.log_error(
+                    f'{len(transient_errors)} requests failed temporarily, {retrying} retrying later: '
+                    f'{http_error_message(transient_errors[0][2]) or transient_errors[0][2].resp.status}'
+                )
+                time.sleep(self.RETRY_DELAY)
+
+    def check_for_quota_violation(self, exit_on_quota=False):
+        """Check for API quota violation and wait until 24 hours have passed if exceeded.
 
         The script can be safely exited while waiting. It will check the time remaining upon next start.
+        With `exit_on_quota`, exit with `EX_TEMPFAIL` instead of waiting, so a scheduler can start the script again later.
+        Progress is not saved before exiting, as saving marks a new timestamp and would restart the 24 hours.
         """
         self.log_info('Checking for quota violation...')
         if self.data.quota_exceeded:
             self.log_info('24 Hour Quota exceeded.')
-            if self.data.last_run_time + self.ONE_DAY > time.time():
-                additional_sleep = self.data.last_run_time + self.ONE_DAY - time.time() + 60  # add 60 seconds buffer
-                self.log_info(f'{time_to_words(additional_sleep)} until quota reset.')
-                recheck_time = min(self.FOUR_HOURS, additional_sleep)
-                self.log_info(f'Re-check status in {time_to_words(recheck_time)}')
-                time.sleep(recheck_time)
-                self.check_for_quota_violation()
-            else:
-                self.log_info('24 hours have passed. Resetting quota violation.')
-                self.data.quota_exceeded = False
+            if (remaining := self.data.last_run_time + self.ONE_DAY - time.time()) > 0:
+                self.log_info(f'{time_to_words(remaining)} until quota reset.')
+                if exit_on_quota:
+                    self.log_info('Exiting until quota reset.')
+                    sys.exit(EX_TEMPFAIL)
+                time.sleep(remaining + 60)  # add 60 seconds buffer
+            self.log_info('24 hours have passed. Resetting quota violation.')
+            self.data.quota_exceeded = False
         else:
             self.log_info('Quota not exceeded.')
 
@@ -299,15 +579,14 @@ class YoutubePlaylistSplitter:
         """
         Check if there are playlists (`self.data.playlists` is not empty) and no videos in any playlists with PENDING status.
         """
-        if all(video.status != VideoStatus.PENDING for video in self.all_videos):
-            self.log_info('All current videos processed. Congratulations!')
-            self.save()
-            return True
-        return False
+        return self._pending_count == 0 and self.has_playlists()
 
     def has_pending_videos_to_process(self) -> bool:
-        """Any video in any playlist has status PENDING."""
-        return any(video.status == VideoStatus.PENDING for video in self.all_videos)
+        """Any video in any playlist has status PENDING.
+
+        Uses `self._pending_count`, which is kept up to date as videos are added and processed.
+        """
+        return self._pending_count > 0
 
     def process_pending_videos(self):
         """Process videos with status PENDING.
@@ -323,66 +602,144 @@ class YoutubePlaylistSplitter:
         :Note: Actions are split between those that require API calls and those that do not in case of quota exceeded in the middle of processing.
         No changes are saved in `self.data` unless the API call was successful, or they do not require an API call.
 
+        Playlists and videos are sent with :meth:`self.execute_batch`, so many calls share one HTTP round-trip.
+        Videos in a playlist that could not be created are set to ERROR, transient errors leave them PENDING.
+        """
+        self.create_missing_playlists()
+
+        def on_success(position, response):
+            playlist = self.data.playlists[position[0]]
+            video = playlist.videos[position[1]]
+            video.previous_id_with_playlist = video.id_with_playlist
+            video.id_with_playlist = response['id']
+            video.previous_playlist_id = video.playlist_id
+            video.playlist_id = playlist.id
+            video.status = VideoStatus.SUCCESS
+            self._pending_count -= 1
+            self.write_ahead(*position)
+            changed_playlist_ids.add(playlist.id)
+            self.log_info(f'Video {video.title}: {video.id} added to playlist {playlist.title}: {playlist.id}')
+
+        def on_error(position, error):
+            video = self.data.playlists[position[0]].videos[position[1]]
+            error_message = http_error_message(error)
+            video.status = VideoStatus.ERROR
+            video.error_message = error_message
+            self._pending_count -= 1
+            self.write_ahead(*position)
+            self.log_error(error_message)
+
+        changed_playlist_ids = set()
+        requests = [
+            ((playlist_index, video_index), self.playlist_item_insert_request(playlist.id, video.id))
+            for playlist_index, playlist in enumerate(self.data.playlists)
+            if playlist.id is not None
+            for video_index, video in enumerate(playlist.videos)
+            if video.status == VideoStatus.PENDING
+        ]
+        self.execute_batch(
+            requests, on_success=on_success, on_error=on_error, changed_playlist_ids=changed_playlist_ids
+        )
+
+    def create_missing_playlists(self):
+        """Create all playlists without an ID that have PENDING videos, in batched API calls.
+
+        If a playlist cannot be created, set its PENDING videos to ERROR so they are not retried endlessly.
         """
-        for playlist in self.data.playlists:
-            if playlist.id is None:
-                new_playlist_id = self.create_playlist(title=playlist.title)
-                self.log_info(f'Created playlist {playlist.title} with ID: {new_playlist_id}')
-                playlist.id = new_playlist_id
-                self.save()
 
-            for video in playlist.videos:
+        def on_success(playlist_index, response):
+            playlist = self.data.playlists[playlist_index]
+            playlist.id = response['id']
+            self._playlist_id_cache[playlist.title] = playlist.id
+            self.write_ahead(playlist_index)
+            self.log_info(f'Created playlist {playlist.title} with ID: {playlist.id}')
+
+        def on_error(playlist_index, error):
+            playlist = self.data.playlists[playlist_index]
+            error_message = f'Error creating playlist {playlist.title}: {http_error_message(error)}'
+            for video_index, video in enumerate(playlist.videos):
                 if video.status == VideoStatus.PENDING:
-                    try:
-                        id_with_playlist = self.add_video_to_playlist(playlist.id, video.id)
-                        video.previous_id_with_playlist = video.id_with_playlist
-                        video.id_with_playlist = id_with_playlist
-                        video.previous_playlist_id = video.playlist_id
-                        video.playlist_id = playlist.id
-                        video.status = VideoStatus.SUCCESS
-                        self.log_info(
-                            f'Video {video.title}: {video.id} added to playlist {playlist.title}: {playlist.id}'
-                        )
-                        self.save()
-                    except QuotaExceededError:
-                        raise
-                    except HttpError as e:
-                        error_message = json.loads(e.content.decode()).get('error', {}).get('message', '')
-                        video.status = VideoStatus.ERROR
-                        video.error_message = error_message
-                        self.log_error(error_message)
-                        self.save()
-
-    @lru_cache
+                    video.status = VideoStatus.ERROR
+                    video.error_message = error_message
+                    self._pending_count -= 1
+                    self.write_ahead(playlist_index, video_index)
+            self.log_error(error_message)
+
+        requests = [
+            (playlist_index, self.playlist_insert_request(title=playlist.title))
+            for playlist_index, playlist in enumerate(self.data.playlists)
+            if playlist.id is None and any(video.status == VideoStatus.PENDING for video in playlist.videos)
+        ]
+        self.execute_batch(requests, on_success=on_success, on_error=on_error)
+
     def get_playlist_id_from_name(self, playlist_name: str) -> str:
-        """Retrieve the playlist ID if the playlist can be found by name."""
+        """Retrieve the playlist ID if the playlist can be found by name.
+
+        Search all pages of the user's playlists. Found and created playlist IDs are kept in
+        `self._playlist_id_cache`, so repeated lookups do not call the API.
+        """
+        if playlist_id := self._playlist_id_cache.get(playlist_name):
+            return playlist_id
         self.log_info(f"Searching for: '{playlist_name}'")
-        request = self.youtube.playlists().list(part='snippet', mine=True, maxResults=50)
-        with self.handle_quota_exceeded():
-            response = request.execute()
-        for item in response['items']:
-            if item['snippet']['title'] == playlist_name:
-                self.log_info(f'Found ID: {item["id"]}')
-                return item['id']
+        next_page_token = None
+        while True:
+            request = self.youtube.playlists().list(
+                part='snippet',
+                fields='nextPageToken,items(id,snippet/title)',
+                mine=True,
+                maxResults=50,
+                pageToken=next_page_token,
+            )
+            with self.handle_quota_exceeded():
+                response = request.execute()
+            for item in response['items']:
+                if item['snippet']['title'] == playlist_name:
+                    self.log_info(f'Found ID: {item["id"]}')
+                    self._playlist_id_cache[playlist_name] = item['id']
+                    return item['id']
+            if not (next_page_token := response.get('nextPageToken')):
+                break
         raise ValueError(f"Playlist '{playlist_name}' not found.")
 
     def get_videos_from_playlist_id(self, playlist_id) -> list[PlaylistVideo]:
-        """Retrieve all videos from a playlist by playlist ID."""
+        """Retrieve all videos from a playlist by playlist ID.
+
+        Pages are cached in `self.page_cache` with their ETag.
+        Cached pages are revalidated with `If-None-Match` and reused if the API responds 304 Not Modified.
+        """
         next_page_token = None
         videos = []
         while True:
+            cache_key = f'{playlist_id}:{next_page_token or ""}'
             request = self.youtube.playlistItems().list(
-                part='id,snippet', playlistId=playlist_id, maxResults=50, pageToken=next_page_token
+                part='id,snippet',
+                fields='etag,nextPageToken,items(id,snippet(title,resourceId/videoId))',  # etag for the page cache
+                playlistId=playlist_id,
+                maxResults=50,
+                pageToken=next_page_token,
             )
-            with self.handle_quota_exceeded():
-                response = request.execute()
-            for item in response['items']:
+            if cached_page := self.page_cache.get(cache_key):
+                request.headers['If-None-Match'] = cached_page.etag
+            try:
+                with self.handle_quota_exceeded():
+                    response = request.execute()
+            except HttpError as e:
+                if cached_page is None or e.resp.status != 304:
+                    raise
+                items, next_page_token = cached_page.items, cached_page.next_page_token
+            else:
+                items, next_page_token = response['items'], response.get('nextPageToken')
+                self.page_cache[cache_key] = CachedPage(
+                    playlist_id=playlist_id, etag=response['etag'], items=items, next_page_token=next_page_token
+                )
+                self._page_cache_dirty = True
+            for item in items:
                 video_id = item['snippet']['resourceId']['videoId']
                 video_title = item['snippet']['title']
                 videos.append(
                     PlaylistVideo(id=video_id, id_with_playlist=item['id'], title=video_title, playlist_id=playlist_id)
                 )
-            if not (next_page_token := response.get('nextPageToken')):
+            if not next_page_token:
                 break
         self.log_info(f'Found {len(videos)} videos in playlist {playlist_id}')
         return videos
@@ -392,65 +749,75 @@ class YoutubePlaylistSplitter:
 
         Playlists will be named with the new_playlist_name and a number suffix.
         Eg. new_playlist_name-1, new_playlist_name-2, etc...
+
+        No API calls are made here, so progress is saved once after all playlists are added.
         """
         random.shuffle(videos)
-        for i, videos in enumerate(split_evenly(videos, target_size=target_size), start=1):
+        for i, playlist_videos in enumerate(split_evenly(videos, target_size=target_size), start=1):
             title = f'{new_playlist_name}-{i}'
-            playlist = Playlist(id=None, title=title, description='', videos=[])
-            for video in videos:
-                playlist.videos.append(video)
-            self.data.playlists.append(playlist)
-            self.log_info(f'Added {len(videos)} videos to playlist {title}')
-            self.save()
+            self.data.playlists.append(Playlist(id=None, title=title, description='', videos=playlist_videos))
+            self.log_info(f'Added {len(playlist_videos)} videos to playlist {title}')
+        self._videos_dirty = True
+        self._pending_count += len(videos)
         self.log_info('All videos added to new playlists.')
+        self.save()
 
-    def create_playlist(self, title, description=''):
+    def playlist_insert_request(self, title, description=''):
         body = {
             'snippet': {'title': title, 'description': description, 'defaultLanguage': 'en'},
             'status': {'privacyStatus': 'public'},
         }
-        request = self.youtube.playlists().insert(part='snippet,status', body=body)
-        with self.handle_quota_exceeded():
-            response = request.execute()
-        return response['id']
+        return self.youtube.playlists().insert(part='snippet,status', body=body)
 
-    def add_video_to_playlist(self, playlist_id, video_id) -> str:
+    def playlist_item_insert_request(self, playlist_id, video_id):
         resource_id = {'kind': 'youtube#video', 'videoId': video_id}
         body = {'snippet': {'playlistId': playlist_id, 'resourceId': resource_id}}
-        request = self.youtube.playlistItems().insert(part='snippet', body=body)
-        with self.handle_quota_exceeded():
-            response = request.execute()
-        return response['id']
+        return self.youtube.playlistItems().insert(part='snippet', body=body)
 
     def delete_playlist_videos(self, playlist_name, playlist_id):
-        deleted_video_count = 0
-        for video in self.all_videos:
-            if (video.previous_playlist_id == playlist_id) and video.status in (VideoStatus.SUCCESS, VideoStatus.ERROR):
-                request = self.youtube.playlistItems().delete(id=video.previous_id_with_playlist)
-                try:  # Handle quota exceeded error inside otherwise HttpError will be caught first and not raise QuotaExceededError
-                    with self.handle_quota_exceeded():
-                        request.execute()
-                        self.log_info(f'Deleted video {video.title} from playlist {playlist_name}: {playlist_id}')
-                        video.previous_playlist_id = None
-                        video.previous_id_with_playlist = None
-                        self.save()
-                        deleted_video_count += 1
-                except HttpError as e:
-                    error_message = json.loads(e.content.decode()).get('error', {}).get('message', '')
-                    video.status = VideoStatus.ERROR
-                    video.error_message = error_message
-                    self.log_error(error_message)
-                    self.save()
-                finally:
-                    self.log_info(f'Deleted {deleted_video_count} videos from playlist {playlist_name}')
-                    self.save()
+        """Delete videos that were added to new playlists from the original playlist, in batched API calls.
+
+        Videos are matched by position rather than `self.all_videos_index`,
+        as the original playlist can contain the same video more than once.
+        """
+        deleted_videos = []
+        changed_playlist_ids = set()
+
+        def on_success(position, response):
+            video = self.data.playlists[position[0]].videos[position[1]]
+            self.log_info(f'Deleted video {video.title} from playlist {playlist_name}: {playlist_id}')
+            video.previous_playlist_id = None
+            video.previous_id_with_playlist = None
+            self.write_ahead(*position)
+            deleted_videos.append(video)
+            changed_playlist_ids.add(playlist_id)
+
+        def on_error(position, error):
+            video = self.data.playlists[position[0]].videos[position[1]]
+            error_message = http_error_message(error)
+            video.status = VideoStatus.ERROR
+            video.error_message = error_message
+            self.write_ahead(*position)
+            self.log_error(error_message)
+
+        requests = [
+            ((playlist_index, video_index), self.youtube.playlistItems().delete(id=video.previous_id_with_playlist))
+            for playlist_index, playlist in enumerate(self.data.playlists)
+            for video_index, video in enumerate(playlist.videos)
+            if (video.previous_playlist_id == playlist_id) and video.status in (VideoStatus.SUCCESS, VideoStatus.ERROR)
+        ]
+        if not requests:
+            return
+        self.execute_batch(
+            requests, on_success=on_success, on_error=on_error, changed_playlist_ids=changed_playlist_ids
+        )
+        self.log_info(f'Deleted {len(deleted_videos)} videos from playlist {playlist_name}')
 
     def playlist_has_new_videos(self, playlist_id: str) -> list[PlaylistVideo]:
         """Check if there are videos in the playlist that are not in the data file."""
         self.log_info('Checking for new videos...')
         videos = self.get_videos_from_playlist_id(playlist_id)
-        current_video_ids = [v.id for v in self.all_videos]
-        if new_videos := [video for video in videos if video.id not in current_video_ids]:
+        if new_videos := [video for video in videos if video.id not in self.all_videos_index]:
             self.log_info(f'Found {len(new_videos)} new videos.')
         return new_videos
 
@@ -459,20 +826,20 @@ class YoutubePlaylistSplitter:
 
         Note: This should only be used if the playlist has been split and new playlists exist.
         This method adds new videos to existing playlists in a round robin fashion.
+        Each video goes to the shortest playlist, the first one of those if several are equally short.
+        Without playlists there is nowhere to add them, the videos are included when the playlist is split.
         """
+        if not self.has_playlists():
+            return
+        heap = [(len(playlist.videos), i, playlist) for i, playlist in enumerate(self.data.playlists)]
+        heapq.heapify(heap)
         for video in new_videos:
-            playlist_lengths = [len(playlist.videos) for playlist in self.data.playlists]
-            max_playlist_length = max(playlist_lengths)
-            if all([length == max_playlist_length for length in playlist_lengths]):
-                first_playlist = self.data.playlists[0]
-                first_playlist.videos.append(video)
-                self.log_info(f'Added video {video.title} to playlist {first_playlist.title}')
-            else:
-                for playlist in self.data.playlists:
-                    if len(playlist.videos) < max_playlist_length:
-                        playlist.videos.append(video)
-                        self.log_info(f'Added video {video.title} to playlist {playlist.title}')
-                        break
+            length, i, playlist = heapq.heappop(heap)
+            playlist.videos.append(video)
+            self.log_info(f'Added video {video.title} to playlist {playlist.title}')
+            heapq.heappush(heap, (length + 1, i, playlist))
+        self._videos_dirty = True
+        self._pending_count += len(new_videos)
         self.save()
         self.log_info(f'Added {len(new_videos)} new videos to playlists.')
 
@@ -494,17 +861,19 @@ def main(args):
     playlist = args.playlist
     splitter = YoutubePlaylistSplitter(checkpoint_filename=args.checkpoint_file)
     splitter.load()
-    splitter.authenticate(args.secret_file)
+    if args.refresh_metadata:
+        splitter.clear_page_cache()
+    splitter.authenticate(args.secret_file, args.token_file)
 
     while True:
         try:
-            splitter.check_for_quota_violation()
+            splitter.check_for_quota_violation(exit_on_quota=args.exit_on_quota)
             playlist_id = splitter.get_playlist_id_from_name(playlist)
 
             if splitter.has_pending_videos_to_process():
                 splitter.process_pending_videos()
 
-            if new_videos := splitter.playlist_has_new_videos(playlist_id):
+            if splitter.has_playlists() and (new_videos := splitter.playlist_has_new_videos(playlist_id)):
                 splitter.add_new_playlist_videos(new_videos)
 
             if args.delete_original:
@@ -512,11 +881,17 @@ def main(args):
 
             if not splitter.has_playlists():
                 videos = splitter.get_videos_from_playlist_id(playlist_id)
+                if not videos:
+                    splitter.log_info(f'Playlist {playlist} has no videos to split. Exiting.')
+                    splitter.save()
+                    sys.exit(0)
                 splitter.split_playlist_videos(
                     videos, new_playlist_name=args.new_playlist, target_size=args.target_size
                 )
 
             if splitter.all_videos_processed():
+                splitter.log_info('All current videos processed. Congratulations!')
+                splitter.save()
                 sys.exit(0)
 
         except QuotaExceededError:
@@ -525,12 +900,14 @@ def main(args):
 
         except KeyboardInterrupt:
             splitter.log_info('User interrupted. Exiting.')
+            splitter.sync_wal()  # not save(), which would restart a running quota wait
             sys.exit(0)
 
 
 if __name__ == '__main__':
     CHECKPOINT_FILE = 'split_playlist_progress.json'
     YOUTUBE_CLIENT_SECRET_FILENAME = 'client_secret.json'  # nosec
+    YOUTUBE_TOKEN_FILENAME = 'token.json'  # nosec
     PLAYLIST_TO_SPLIT = 'WSC'
     NEW_PLAYLIST_NAME = 'WSC'
     PLAYLIST_SIZE = 90
@@ -550,16 +927,28 @@ if __name__ == '__main__':
     parser.add_argument(
         '--secret-file', required=False, default=YOUTUBE_CLIENT_SECRET_FILENAME, help='YouTube client secret filename'
     )
+    parser.add_argument(
+        '--token-file', required=False, default=YOUTUBE_TOKEN_FILENAME, help='Filename to cache OAuth credentials'
+    )
     parser.add_argument('--playlist', required=False, default=PLAYLIST_TO_SPLIT, help='Name of playlist to split')
     parser.add_argument(
         '--new-playlist', required=False, default=PLAYLIST_TO_SPLIT, help='Name of new playlists to create from split'
     )
     parser.add_argument(
-        '--target-size', required=False, default=PLAYLIST_SIZE, help='Target size of the split playlists'
+        '--target-size', required=False, type=int, default=PLAYLIST_SIZE, help='Target size of the split playlists'
     )
     parser.add_argument(
         '--delete-original', required=False, action='store_true', help='Delete original playlist videos after splitting'
     )
+    parser.add_argument(
+        '--refresh-metadata', required=False, action='store_true', help='Ignore cached playlist pages and re-fetch them'
+    )
+    parser.add_argument(
+        '--exit-on-quota',
+        required=False,
+        action='store_true',
+        help=f'Exit with code {EX_TEMPFAIL} instead of waiting for the quota to reset',
+    )
     parser.add_argument('--view-logs', required=False, action='store_true', help='View progress logs')
     parser.add_argument('--view-stats', required=False, action='store_true', help='View saved playlist stats')
     parser.add_argument('--view-video-errors', required=False, action='store_true', help='View videos with errors')